@@ -0,0 +1,78 @@
+from bisect import bisect_left, insort
+from collections import deque
+from datetime import timedelta
+from typing import Deque, List
+
+
+class CapturePolicy:
+    """
+    Decides after every top level call whether its trace records are kept and exported or dropped
+    """
+
+    def should_capture(self, duration: timedelta, raised: bool) -> bool:
+        """
+        :param duration: how long the top level call took
+        :param raised: whether the top level call raised an exception
+        :return: whether the records of the call get exported
+        """
+        pass
+
+
+class CaptureAll(CapturePolicy):
+    def should_capture(self, duration: timedelta, raised: bool) -> bool:
+        return True
+
+
+class LatencyThresholdCapture(CapturePolicy):
+    """
+    Captures calls that took longer than a fixed threshold or raised an exception
+    """
+
+    def __init__(self, threshold: timedelta):
+        self.threshold = threshold
+
+    def should_capture(self, duration: timedelta, raised: bool) -> bool:
+        return raised or duration > self.threshold
+
+
+class PercentileCapture(CapturePolicy):
+    """
+    Captures calls that took longer than a percentile (e.g. p99) of the recent durations or raised an exception.
+    The percentile is computed over a sliding window, until it holds min_samples durations only exceptions are captured.
+    """
+
+    def __init__(self, percentile: float = 99.0, window: int = 1000, min_samples: int = 100):
+        """
+        :param percentile: the percentile a duration has to exceed, between 0 and 100
+        :param window: how many of the most recent durations the percentile is computed over
+        :param min_samples: how many durations have to be seen before calls are captured for being slow
+        """
+        if not 0 <= percentile <= 100:
+            raise ValueError(f"percentile has to be between 0 and 100, got {percentile}")
+        if window < 1:
+            raise ValueError(f"window has to be positive, got {window}")
+        self.percentile = percentile
+        self.min_samples = min(min_samples, window)
+        self._durations: Deque[timedelta] = deque(maxlen=window)
+        self._sorted_durations: List[timedelta] = []
+
+    def should_capture(self, duration: timedelta, raised: bool) -> bool:
+        is_slow = len(self._sorted_durations) >= self.min_samples and duration > self.threshold()
+        self._add_duration(duration)
+        return raised or is_slow
+
+    def threshold(self) -> timedelta:
+        """
+        :return: the current percentile of the recent durations
+        """
+        if not self._sorted_durations:
+            return timedelta.max
+        index = round(self.percentile / 100 * (len(self._sorted_durations) - 1))
+        return self._sorted_durations[index]
+
+    def _add_duration(self, duration: timedelta) -> None:
+        if len(self._durations) == self._durations.maxlen:
+            oldest = self._durations[0]
+            del self._sorted_durations[bisect_left(self._sorted_durations, oldest)]
+        self._durations.append(duration)
+        insort(self._sorted_durations, duration)
@@ -1,6 +1,15 @@
-from typing import List
+import json
+import math
+import multiprocessing
+import os
+from operator import attrgetter
+from typing import List, Dict, Tuple, Any, Iterator, Optional, Union
+
+import numpy as np
+
+from .serialize import ArgumentSerializer
 from .types import TraceRecord
-from datetime import datetime
+from datetime import datetime, timedelta
 
 
 class TraceExporter:
@@ -11,6 +20,16 @@ class TraceExporter:
     def export(self, records: List[TraceRecord]):
         pass
 
+    def append(self, records: List[TraceRecord], all_records: List[TraceRecord]):
+        """
+        Gets called by trace after every captured call.
+        Exports all records again by default, exporters that can add to an earlier export override it.
+        :param records: the records captured since the last call
+        :param all_records: all records captured so far, ending with records
+        :return: None
+        """
+        self.export(all_records)
+
 
 class ChromeJsonExporter(TraceExporter):
     """
@@ -19,13 +38,43 @@ class ChromeJsonExporter(TraceExporter):
     https://docs.google.com/document/d/1CvAClvFfyA5R-PhYUmn5OOQtYMH4h6I0nSsKchNAySU/edit#
     """
 
-    def __init__(self, file_name):
+    def __init__(self, file_name, serializer: Union[ArgumentSerializer, bool, None] = None):
+        """
+        :param file_name: the file to export to
+        :param serializer: turns the captured arguments into the "args" of an event, defaults to ArgumentSerializer().
+                           False leaves the arguments out of the export.
+        """
         self.file_name = file_name
+        # start time of the last export, the records of later appends are relative to it
+        self._begin_time: Optional[datetime] = None
+        self.serializer: Optional[ArgumentSerializer] = None
+        if isinstance(serializer, ArgumentSerializer):
+            self.serializer = serializer
+        elif serializer is not False:
+            self.serializer = ArgumentSerializer()
 
     def export(self, records: List[TraceRecord]):
-        times = list(map(lambda elem: elem.start_time, records))
-        begin_time = min(times) if times else datetime.now()
-        lines = ["[\n"]
+        self._begin_time = min(map(attrgetter("start_time"), records)) if records else None
+        self._write(self._format_events(records, self._begin_time or datetime.now()), append=False)
+
+    def append(self, records: List[TraceRecord], all_records: List[TraceRecord]):
+        """
+        Only formats the new records and adds them to the end of the file, instead of exporting all records again.
+        Their timestamps are relative to the begin of the first export.
+        """
+        if not records:
+            return
+        if self._begin_time is None:
+            self.export(records)
+        else:
+            self._write(self._format_events(records, self._begin_time), append=True)
+
+    def _format_events(self, records: List[TraceRecord], begin_time: datetime) -> Iterator[str]:
+        """
+        :param records: the records to format
+        :param begin_time: the start time of the whole trace, timestamps are relative to it
+        :return: an iterator over the formatted events, several events in one item are separated by ",\n"
+        """
         for record in records:
             time_stamp = record.start_time - begin_time
             time_stamp_micros = time_stamp.total_seconds() * 1_000_000
@@ -42,16 +91,235 @@ class ChromeJsonExporter(TraceExporter):
             line += f" \"tid\": 0,"
             line += f" \"ts\": {time_stamp_micros},"
             line += f" \"dur\": {duration_micros}"
-            line += "},\n"
-            lines.append(line)
+            line += _chrome_event_args(self.serializer, record)
+            line += "}"
+            yield line
+
+    def _write(self, events: Iterator[str], append: bool) -> None:
+        """
+        Writes the events as json array
+        :param events: the formatted events
+        :param append: whether to add the events to the array written by the last export instead of replacing the file
+        :return: None
+        """
+        with open(self.file_name, "rb+" if append else "wb") as f:
+            if append:
+                # overwrites the end of the array, it is written again after the new events
+                f.seek(-len(_ARRAY_END), os.SEEK_END)
+                separator = b",\n"
+            else:
+                f.write(b"[\n")
+                separator = b""
+            for event in events:
+                f.write(separator)
+                f.write(event.encode())
+                separator = b",\n"
+            f.write(_ARRAY_END if separator else b"]\n")
+
+
+_ARRAY_END = b"\n]\n"
+
+
+def _chrome_event_args(serializer: Optional[ArgumentSerializer], record: TraceRecord) -> str:
+    """
+    Serializes the arguments of a record lazily, so the call path only has to keep references to them
+    :param serializer: the serializer to use, None leaves the arguments out
+    :param record: the record to serialize the arguments of
+    :return: the "args" entry of a chrome event including the leading comma, empty if there are no arguments
+    """
+    if serializer is None or (not record.arguments and not record.keyword_arguments):
+        return ""
+    args = serializer.serialize_arguments(record.arguments, record.keyword_arguments)
+    return f", \"args\": {_encode_json(args)}"
+
+
+def _chrome_chunk_args(serializer: Optional[ArgumentSerializer], records: List[TraceRecord]) -> List[str]:
+    """
+    Like _chrome_event_args for a whole chunk, but encodes all arguments of the chunk with a single json.dumps
+    :param serializer: the serializer to use, None leaves the arguments out
+    :param records: the records of the chunk
+    :return: the "args" entries of the records, empty for records without arguments
+    """
+    result = [""] * len(records)
+    if serializer is None:
+        return result
+
+    indices = [index for index, record in enumerate(records) if record.arguments or record.keyword_arguments]
+    values = [serializer.serialize_arguments(records[index].arguments, records[index].keyword_arguments)
+              for index in indices]
+    for index, encoded in zip(indices, _encode_json_batch(values)):
+        result[index] = f", \"args\": {encoded}"
+    return result
+
+
+def _encode_json(value: Any) -> str:
+    try:
+        return json.dumps(value, allow_nan=False)
+    except (TypeError, ValueError):
+        # a registered serializer returned something that is no json
+        return json.dumps(f"<{type(value).__name__}>")
+
+
+# raw control characters only ever show up in json.dumps output as separators, everything else escapes them
+_ITEM_SEPARATOR = "\x1e"
+_VALUE_SEPARATOR = "\x1f"
+
+
+def _encode_json_batch(values: List[Any]) -> List[str]:
+    """
+    Encodes many values with a single json.dumps call instead of one call each.
+    The values are dumped as one list with a raw control character as item separator and NaN between the values.
+    The serializer turns nan into a string, so a raw NaN between two separators can only be one of the inserted
+    markers and marks the boundaries of the values.
+    :param values: json compatible values
+    :return: the json encoding of every value, as json.dumps would return it
+    """
+    if not values:
+        return []
+    items: List[Any] = [math.nan] * (2 * len(values) - 1)
+    items[::2] = values
+    try:
+        encoded = json.dumps(items, separators=(_ITEM_SEPARATOR, ": "))
+    except (TypeError, ValueError):
+        return [_encode_json(value) for value in values]
+    marker = f"{_ITEM_SEPARATOR}NaN{_ITEM_SEPARATOR}"
+    result = encoded[1:-1].replace(marker, _VALUE_SEPARATOR).replace(_ITEM_SEPARATOR, ", ").split(_VALUE_SEPARATOR)
+    if len(result) != len(values):
+        # a registered serializer returned nan itself
+        return [_encode_json(value) for value in values]
+    return result
+
+
+_MICROSECOND = timedelta(microseconds=1)
+# marks records without an end time, can not collide with a real offset
+_NOT_FINISHED = -2 ** 63
+
+# <records, begin time of the trace, serializer> of the export a worker process belongs to.
+# Only ever set inside a worker by _init_chrome_worker, the parent process never touches it.
+_WORKER_STATE: Optional[Tuple[List[TraceRecord], datetime, Optional[ArgumentSerializer]]] = None
+
+
+def _available_cpus() -> int:
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def _chrome_event_prefix(function_name: str) -> str:
+    return f"{{\"name\": {json.dumps(function_name)}, \"cat\": \"abc\", \"ph\": \"X\", \"pid\": 0, \"tid\": 0, \"ts\": "
+
+
+def _to_arrays(records: List[TraceRecord], begin_time: datetime) -> Tuple[List[str], Any, Any, Any]:
+    """
+    Converts the records into int64 arrays with function ids, relative timestamps and durations
+    :param records: the records to convert
+    :param begin_time: the start time of the whole trace, timestamps are relative to it
+    :return: a tuple with <event prefixes per function id, function ids, timestamps in micros, durations in micros>
+    """
+    function_names = list(map(attrgetter("function_name"), records))
+    start_times = list(map(attrgetter("start_time"), records))
+    end_times = list(map(attrgetter("end_time"), records))
+
+    ids: Dict[str, int] = {}
+    function_ids = np.fromiter((ids.setdefault(name, len(ids)) for name in function_names),
+                               dtype=np.int64, count=len(function_names))
+    prefixes = [_chrome_event_prefix(name) for name in ids]
+
+    # datetime -> datetime64 conversion in numpy is slow, the integer offsets are computed per element instead
+    time_stamps = np.fromiter(((start - begin_time) // _MICROSECOND for start in start_times),
+                              dtype=np.int64, count=len(start_times))
+    ends = np.fromiter(((end - begin_time) // _MICROSECOND if end is not None else _NOT_FINISHED
+                        for end in end_times), dtype=np.int64, count=len(end_times))
+    durations = np.where(ends == _NOT_FINISHED, 0, ends - time_stamps)
+    return prefixes, function_ids, time_stamps, durations
+
+
+def _format_chrome_chunk(records: List[TraceRecord], begin_time: datetime,
+                         serializer: Optional[ArgumentSerializer]) -> str:
+    """
+    Converts and formats one chunk of records into chrome json lines, including serializing their arguments
+    :param records: the records of the chunk
+    :param begin_time: the start time of the whole trace
+    :param serializer: the serializer for the arguments, None leaves them out
+    :return: the events of the chunk separated by ",\n"
+    """
+    prefixes, function_ids, time_stamps, durations = _to_arrays(records, begin_time)
+    args = _chrome_chunk_args(serializer, records)
+    events = zip(function_ids.tolist(), time_stamps.tolist(), durations.tolist(), args)
+    lines = [f"{prefixes[function_id]}{time_stamp}, \"dur\": {duration}{event_args}}}"
+             for function_id, time_stamp, duration, event_args in events]
+    return ",\n".join(lines)
+
+
+def _init_chrome_worker(records: List[TraceRecord], begin_time: datetime,
+                        serializer: Optional[ArgumentSerializer]) -> None:
+    """
+    Initializer of the worker processes of one export. The pool forks, so the arguments are inherited, not pickled.
+    """
+    global _WORKER_STATE
+    _WORKER_STATE = records, begin_time, serializer
+
+
+def _format_forked_chrome_chunk(bounds: Tuple[int, int]) -> str:
+    """
+    Formats a chunk of the export that was running when the worker process got forked.
+    Only the bounds are sent to the worker, the records themselves are never pickled.
+    :param bounds: <begin, end> of the chunk
+    :return: the events of the chunk separated by ",\n"
+    """
+    assert _WORKER_STATE is not None, "worker was not initialized by _init_chrome_worker"
+    records, begin_time, serializer = _WORKER_STATE
+    begin, end = bounds
+    return _format_chrome_chunk(records[begin:end], begin_time, serializer)
+
+
+class NumpyChromeJsonExporter(ChromeJsonExporter):
+    """
+    Exports a recorded trace to the same chrome json format as ChromeJsonExporter, but is meant for very large traces.
+    The records are split into chunks. Per chunk the start and end offsets are computed per record in whole
+    microseconds (numpy's datetime64 conversion is slower) and collected into int64 arrays, only the durations are
+    computed vectorized. Events are formatted with one f-string each from a prefix precomputed per function name, the
+    arguments of a chunk are encoded with a single json.dumps and each chunk is written at once.
+    The chunks can be spread across forked worker processes, which inherit the records instead of receiving them
+    pickled. Most of the time of traces with arguments goes into serializing them.
+    """
+
+    def __init__(self, file_name, serializer: Union[ArgumentSerializer, bool, None] = None, chunk_size: int = 100_000,
+                 processes: Optional[int] = None):
+        """
+        :param file_name: the file to export to
+        :param serializer: turns the captured arguments into the "args" of an event, defaults to ArgumentSerializer().
+                           False leaves the arguments out of the export.
+        :param chunk_size: how many events get converted and written at once
+        :param processes: max number of forked worker processes, capped at the available cpus.
+                          None or < 2 (or a platform without fork) exports in process.
+                          A new pool is forked on every export, so this is meant for one off bulk exports of
+                          large traces, not for an exporter passed to trace, which appends after every captured call
+        """
+        if chunk_size < 1:
+            raise ValueError(f"chunk_size has to be positive, got {chunk_size}")
+        super().__init__(file_name, serializer)
+        self.chunk_size = chunk_size
+        self.processes = processes
 
-        if len(lines) > 1:
-            # removing trailing comma after last element (to make it valid json)
-            line = lines[-1]
-            new_line = line[:-2] + "\n"
-            lines[-1] = new_line
+    def _format_events(self, records: List[TraceRecord], begin_time: datetime) -> Iterator[str]:
+        """
+        :param records: the records to format
+        :param begin_time: the start time of the whole trace, timestamps are relative to it
+        :return: an iterator over the formatted chunks, in record order
+        """
+        if not records:
+            return iter(())
 
-        lines.append("]\n")
+        bounds = [(begin, begin + self.chunk_size) for begin in range(0, len(records), self.chunk_size)]
+        # more workers than cpus only add forking and pickling the results back on top of the serial work
+        processes = min(self.processes or 1, len(bounds), _available_cpus())
+        if processes < 2 or "fork" not in multiprocessing.get_all_start_methods():
+            return (_format_chrome_chunk(records[begin:end], begin_time, self.serializer) for begin, end in bounds)
+        return self._format_chunks_in_pool(records, begin_time, bounds, processes)
 
-        with open(self.file_name, "w+") as f:
-            f.writelines(lines)
+    def _format_chunks_in_pool(self, records: List[TraceRecord], begin_time: datetime,
+                               bounds: List[Tuple[int, int]], processes: int) -> Iterator[str]:
+        initargs = (records, begin_time, self.serializer)
+        with multiprocessing.get_context("fork").Pool(processes, _init_chrome_worker, initargs) as pool:
+            yield from pool.imap(_format_forked_chrome_chunk, bounds)
@@ -0,0 +1,228 @@
+import dataclasses
+import datetime
+from math import isfinite
+from decimal import Decimal
+from enum import Enum
+from itertools import islice
+from typing import Any, Callable, Dict, Set, Tuple, Type
+
+# a serializer gets the object and a callback to serialize nested values with
+Serializer = Callable[[Any, Callable[[Any], Any]], Any]
+
+TRUNCATED = "..."
+CYCLE = "<cycle>"
+
+_PLAIN_TYPES = (type(None), bool, int)
+
+
+class _SerializationContext:
+    """
+    Keeps track of the depth and the containers currently being serialized for one top level value
+    """
+
+    def __init__(self, argument_serializer: 'ArgumentSerializer'):
+        self.argument_serializer = argument_serializer
+        self.dispatch = argument_serializer.dispatch
+        self.max_depth = argument_serializer.max_depth
+        self.max_string_length = argument_serializer.max_string_length
+        self.depth = 0
+        self.in_progress: Set[int] = set()
+
+    def __call__(self, obj: Any) -> Any:
+        obj_type = type(obj)
+        if obj_type in _PLAIN_TYPES:
+            return obj
+        if obj_type is str:
+            if len(obj) <= self.max_string_length:
+                return obj
+        elif obj_type is float:
+            if isfinite(obj):
+                return obj
+        serializer, recursive = self.dispatch(obj_type)
+        if not recursive:
+            # leaves can neither be too deep nor form cycles
+            try:
+                return serializer(obj, self)
+            except Exception:
+                return self.argument_serializer.serialize_fallback(obj)
+
+        if self.depth > self.max_depth:
+            return f"<{obj_type.__name__}>"
+        obj_id = id(obj)
+        if obj_id in self.in_progress:
+            return CYCLE
+        self.in_progress.add(obj_id)
+        self.depth += 1
+        try:
+            return serializer(obj, self)
+        except Exception:
+            # a broken value (or serializer) must never abort the export of the whole trace
+            return self.argument_serializer.serialize_fallback(obj)
+        finally:
+            self.depth -= 1
+            self.in_progress.discard(obj_id)
+
+
+class ArgumentSerializer:
+    """
+    Turns captured arguments into json compatible values.
+    Serializers are registered per type, the serializer for a type is looked up along its mro once and then cached.
+    Nested values are limited in depth and length and cyclic references are replaced by a marker.
+    """
+
+    def __init__(self, max_depth: int = 4, max_length: int = 32, max_string_length: int = 256):
+        """
+        :param max_depth: how many levels of containers below the top level value get serialized,
+                          deeper containers are replaced by their type name
+        :param max_length: how many items of a container get serialized
+        :param max_string_length: after how many characters strings get cut
+        """
+        self.max_depth = max_depth
+        self.max_length = max_length
+        self.max_string_length = max_string_length
+        # <serializer, whether it serializes nested values>
+        self._serializers: Dict[type, Tuple[Serializer, bool]] = {}
+        self._dispatch_cache: Dict[type, Tuple[Serializer, bool]] = {}
+        self._register_defaults()
+
+    def register(self, obj_type: Type, serializer: Serializer, recursive: bool = True) -> None:
+        """
+        Registers a serializer for a type and all its subclasses
+        :param obj_type: the type to serialize
+        :param serializer: gets the object and a callback to serialize nested values, returns a json compatible value
+        :param recursive: whether the serializer uses the callback. Only those count towards max_depth and are
+                          checked for cycles, so leaf types should pass False
+        :return: None
+        """
+        self._serializers[obj_type] = serializer, recursive
+        self._dispatch_cache.clear()
+
+    def get_serializer(self, obj_type: type) -> Serializer:
+        """
+        :param obj_type: the type of the object to serialize
+        :return: the registered serializer of the closest base class
+        """
+        return self.dispatch(obj_type)[0]
+
+    def dispatch(self, obj_type: type) -> Tuple[Serializer, bool]:
+        """
+        :param obj_type: the type of the object to serialize
+        :return: a tuple with <serializer of the closest base class, whether it is recursive>
+        """
+        try:
+            return self._dispatch_cache[obj_type]
+        except KeyError:
+            pass
+
+        entry = self._find_serializer(obj_type)
+        self._dispatch_cache[obj_type] = entry
+        return entry
+
+    def _find_serializer(self, obj_type: type) -> Tuple[Serializer, bool]:
+        # object is left out, so dataclasses are preferred over the fallback
+        for base in obj_type.__mro__[:-1]:
+            if base in self._serializers:
+                return self._serializers[base]
+        if dataclasses.is_dataclass(obj_type):
+            return self._serialize_dataclass, True
+        return self._serializers[object]
+
+    def serialize(self, obj: Any) -> Any:
+        """
+        :param obj: any object
+        :return: a json compatible representation of obj
+        """
+        return _SerializationContext(self)(obj)
+
+    def serialize_arguments(self, arguments: Tuple[Any, ...], keyword_arguments: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        :param arguments: the positional arguments of a call
+        :param keyword_arguments: the keyword arguments of a call
+        :return: a dict with the serialized "args" and "kwargs", empty ones are left out
+        """
+        serialize = _SerializationContext(self)
+        # args and kwargs are the top level containers, they are fresh objects of a known type and can't be part
+        # of a cycle, so dispatching them and tracking their ids is skipped
+        serialize.depth = 1
+        result: Dict[str, Any] = {}
+        if arguments:
+            result["args"] = self._serialize_iterable(arguments, serialize)
+        if keyword_arguments:
+            result["kwargs"] = self._serialize_dict(keyword_arguments, serialize)
+        return result
+
+    def _register_defaults(self) -> None:
+        self.register(object, self._serialize_repr, recursive=False)
+        # exact ints are handled by _SerializationContext already, this is for subclasses like IntEnum
+        self.register(int, lambda obj, serialize: obj, recursive=False)
+        self.register(float, _serialize_float, recursive=False)
+        self.register(str, self._serialize_str, recursive=False)
+        self.register(bytes, self._serialize_repr, recursive=False)
+        self.register(Decimal, lambda obj, serialize: _serialize_float(float(obj), serialize), recursive=False)
+        self.register(Enum, lambda obj, serialize: str(obj), recursive=False)
+        self.register(datetime.date, lambda obj, serialize: obj.isoformat(), recursive=False)
+        self.register(datetime.time, lambda obj, serialize: obj.isoformat(), recursive=False)
+        self.register(datetime.timedelta, lambda obj, serialize: obj.total_seconds(), recursive=False)
+        self.register(list, self._serialize_iterable)
+        self.register(tuple, self._serialize_iterable)
+        self.register(set, self._serialize_iterable)
+        self.register(frozenset, self._serialize_iterable)
+        self.register(dict, self._serialize_dict)
+
+    def _serialize_str(self, obj: str, serialize: Callable[[Any], Any]) -> str:
+        if len(obj) > self.max_string_length:
+            return obj[:self.max_string_length] + TRUNCATED
+        return obj
+
+    def serialize_fallback(self, obj: Any) -> str:
+        """
+        :param obj: an object whose serializer raised
+        :return: the cut repr of obj, or its type name if repr raises as well
+        """
+        try:
+            text = repr(obj)
+        except Exception:
+            return f"<{type(obj).__name__}>"
+        return self._serialize_str(text, self.serialize)
+
+    def _serialize_repr(self, obj: Any, serialize: Callable[[Any], Any]) -> str:
+        return self.serialize_fallback(obj)
+
+    def _serialize_iterable(self, obj: Any, serialize: Callable[[Any], Any]) -> list:
+        result = [serialize(item) for item in islice(obj, self.max_length)]
+        if len(obj) > self.max_length:
+            result.append(TRUNCATED)
+        return result
+
+    def _serialize_dict(self, obj: dict, serialize: Callable[[Any], Any]) -> Any:
+        """
+        :return: a dict if all keys are strings that stay distinct after truncating them, otherwise a list of
+                 [key, value] pairs, so no entry gets lost
+        """
+        result = {}
+        for key, value in islice(obj.items(), self.max_length):
+            if not isinstance(key, str):
+                return self._serialize_pairs(obj, serialize)
+            serialized_key = self._serialize_str(key, serialize)
+            if serialized_key in result or serialized_key == TRUNCATED:
+                return self._serialize_pairs(obj, serialize)
+            result[serialized_key] = serialize(value)
+        if len(obj) > self.max_length:
+            result[TRUNCATED] = TRUNCATED
+        return result
+
+    def _serialize_pairs(self, obj: dict, serialize: Callable[[Any], Any]) -> list:
+        result: list = [[serialize(key), serialize(value)] for key, value in islice(obj.items(), self.max_length)]
+        if len(obj) > self.max_length:
+            result.append(TRUNCATED)
+        return result
+
+    def _serialize_dataclass(self, obj: Any, serialize: Callable[[Any], Any]) -> dict:
+        # unlike dataclasses.asdict this does not deep copy the nested values
+        return self._serialize_dict({field.name: getattr(obj, field.name) for field in dataclasses.fields(obj)},
+                                    serialize)
+
+
+def _serialize_float(obj: float, serialize: Callable[[Any], Any]) -> Any:
+    # nan and inf are no valid json
+    return obj if isfinite(obj) else str(obj)
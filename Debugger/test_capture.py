@@ -0,0 +1,50 @@
+from datetime import timedelta
+
+import pytest
+
+from .capture import CaptureAll, LatencyThresholdCapture, PercentileCapture
+
+
+def millis(value: int) -> timedelta:
+    return timedelta(milliseconds=value)
+
+
+def test_capture_all_captures_everything():
+    policy = CaptureAll()
+    assert policy.should_capture(millis(0), raised=False)
+
+
+def test_latency_threshold_captures_slow_calls_and_exceptions():
+    policy = LatencyThresholdCapture(millis(10))
+    assert not policy.should_capture(millis(10), raised=False)
+    assert policy.should_capture(millis(11), raised=False)
+    assert policy.should_capture(millis(1), raised=True)
+
+
+class TestPercentileCapture:
+    def test_captures_only_exceptions_until_min_samples(self):
+        policy = PercentileCapture(percentile=50, window=10, min_samples=3)
+        assert not policy.should_capture(millis(1), raised=False)
+        assert not policy.should_capture(millis(100), raised=False)
+        assert policy.should_capture(millis(1), raised=True)
+
+    def test_captures_calls_slower_than_percentile(self):
+        policy = PercentileCapture(percentile=90, window=100, min_samples=10)
+        for duration in range(10):
+            policy.should_capture(millis(duration), raised=False)
+
+        assert policy.threshold() == millis(8)
+        assert not policy.should_capture(millis(8), raised=False)
+        assert policy.should_capture(millis(9), raised=False)
+
+    def test_forgets_durations_outside_of_window(self):
+        policy = PercentileCapture(percentile=100, window=3, min_samples=1)
+        for duration in [100, 1, 1, 1]:
+            policy.should_capture(millis(duration), raised=False)
+
+        assert policy.threshold() == millis(1)
+        assert policy.should_capture(millis(2), raised=False)
+
+    def test_rejects_invalid_percentile(self):
+        with pytest.raises(ValueError):
+            PercentileCapture(percentile=101)
@@ -1,12 +1,17 @@
+import json
+import os
 import tempfile
-from .export import ChromeJsonExporter
+
+from . import export
+from .export import ChromeJsonExporter, NumpyChromeJsonExporter
+from .serialize import ArgumentSerializer
 from .types import TraceRecord
-from datetime import datetime
+from datetime import datetime, timedelta
 
 
-def assert_can_persist_records(expected_lines, records):
+def assert_can_persist_records(expected_lines, records, exporter_class=ChromeJsonExporter):
     with tempfile.NamedTemporaryFile(suffix=".json") as f:
-        exporter = ChromeJsonExporter(f.name)
+        exporter = exporter_class(f.name)
         exporter.export(records)
 
         lines = f.readlines()
@@ -15,6 +20,22 @@ def assert_can_persist_records(expected_lines, records):
             assert l1 == l2
 
 
+def assert_appends_like_one_export(exporter_class):
+    begin = datetime(2020, 1, 1)
+    records = [
+        TraceRecord(f"method_{i}", (i,), dict(), begin + timedelta(seconds=i), begin + timedelta(seconds=i + 1))
+        for i in range(5)
+    ]
+    with tempfile.NamedTemporaryFile(suffix=".json") as expected, tempfile.NamedTemporaryFile(suffix=".json") as f:
+        exporter_class(expected.name).export(records)
+        exporter = exporter_class(f.name)
+        exporter.append(records[:2], records[:2])
+        exporter.append([], records[:2])
+        exporter.append(records[2:], records)
+
+        assert f.read() == expected.read()
+
+
 class TestChromeExporter:
     def test_can_export_zero_records(self):
         records = []
@@ -45,3 +66,126 @@ class TestChromeExporter:
             b']\n'
         ]
         assert_can_persist_records(expected_lines, records)
+
+    def test_exports_arguments(self):
+        records = [
+            TraceRecord("method", ("Test", datetime(2020, 1, 1)), {"kwarg": [1, 2]}, datetime(2020, 1, 1),
+                        datetime(2020, 1, 2))
+        ]
+        expected_lines = [
+            b'[\n',
+            b'{"name": "method", "cat": "abc", "ph": "X", "pid": 0, "tid": 0, "ts": 0.0, "dur": 86400000000.0, '
+            b'"args": {"args": ["Test", "2020-01-01T00:00:00"], "kwargs": {"kwarg": [1, 2]}}}\n',
+            b']\n'
+        ]
+        assert_can_persist_records(expected_lines, records)
+
+    def test_appends_only_new_records_to_the_file(self):
+        assert_appends_like_one_export(ChromeJsonExporter)
+
+
+class TestNumpyChromeExporter:
+    def test_can_export_zero_records(self):
+        expected_lines = [b'[\n', b']\n']
+        assert_can_persist_records(expected_lines, [], NumpyChromeJsonExporter)
+
+    def test_can_export_two_or_more_records(self):
+        records = [
+            TraceRecord("method", tuple(), dict(), datetime(2020, 1, 1), datetime(2020, 1, 4)),
+            TraceRecord("method", tuple(), dict(), datetime(2020, 1, 2), datetime(2020, 1, 3)),
+            TraceRecord("other", ("Test",), dict(), datetime(2020, 1, 2, microsecond=5))
+        ]
+        expected_lines = [
+            b'[\n',
+            b'{"name": "method", "cat": "abc", "ph": "X", "pid": 0, "tid": 0, "ts": 0, "dur": 259200000000},\n',
+            b'{"name": "method", "cat": "abc", "ph": "X", "pid": 0, "tid": 0, "ts": 86400000000, '
+            b'"dur": 86400000000},\n',
+            b'{"name": "other", "cat": "abc", "ph": "X", "pid": 0, "tid": 0, "ts": 86400000005, "dur": 0, '
+            b'"args": {"args": ["Test"]}}\n',
+            b']\n'
+        ]
+        assert_can_persist_records(expected_lines, records, NumpyChromeJsonExporter)
+
+    def test_appends_only_new_records_to_the_file(self):
+        assert_appends_like_one_export(NumpyChromeJsonExporter)
+
+    def test_exports_same_events_as_chrome_exporter_across_chunks_and_processes(self):
+        begin = datetime(2020, 1, 1)
+        records = [
+            TraceRecord(f"method_{i % 3}", (i,), dict(), begin + timedelta(seconds=i),
+                        begin + timedelta(seconds=2 * i))
+            for i in range(10)
+        ]
+        with tempfile.NamedTemporaryFile(suffix=".json") as expected, tempfile.NamedTemporaryFile(suffix=".json") as f:
+            ChromeJsonExporter(expected.name).export(records)
+            NumpyChromeJsonExporter(f.name, chunk_size=3, processes=2).export(records)
+
+            assert json.load(f) == json.load(expected)
+
+    def test_formats_chunks_in_worker_processes(self, monkeypatch):
+        original_prefix = export._chrome_event_prefix
+        monkeypatch.setattr(export, "_available_cpus", lambda: 2)
+        # workers are forked, so they see the patched prefix and tag every event with their pid
+        monkeypatch.setattr(export, "_chrome_event_prefix", lambda name: original_prefix(f"{name}@{os.getpid()}"))
+        records = [TraceRecord("method", tuple(), dict(), datetime(2020, 1, 1, second=i)) for i in range(10)]
+
+        with tempfile.NamedTemporaryFile(suffix=".json") as f:
+            NumpyChromeJsonExporter(f.name, chunk_size=3, processes=2).export(records)
+            events = json.load(f)
+
+        pids = {int(event["name"].split("@")[1]) for event in events}
+        assert len(events) == 10
+        assert os.getpid() not in pids
+
+    def test_serializes_arguments_in_worker_processes(self, monkeypatch):
+        class Marker:
+            pass
+
+        monkeypatch.setattr(export, "_available_cpus", lambda: 2)
+        serializer = ArgumentSerializer()
+        serializer.register(Marker, lambda obj, serialize: os.getpid())
+        records = [TraceRecord("method", (Marker(),), dict(), datetime(2020, 1, 1, second=i)) for i in range(10)]
+
+        with tempfile.NamedTemporaryFile(suffix=".json") as f:
+            NumpyChromeJsonExporter(f.name, serializer=serializer, chunk_size=3, processes=2).export(records)
+            events = json.load(f)
+
+        pids = {event["args"]["args"][0] for event in events}
+        assert len(events) == 10
+        assert os.getpid() not in pids
+
+    def test_can_leave_out_arguments(self):
+        records = [TraceRecord("method", ("Test",), {"kwarg": 1}, datetime(2020, 1, 1), datetime(2020, 1, 2))]
+        expected_lines = [
+            b'[\n',
+            b'{"name": "method", "cat": "abc", "ph": "X", "pid": 0, "tid": 0, "ts": 0, "dur": 86400000000}\n',
+            b']\n'
+        ]
+        assert_can_persist_records(expected_lines, records,
+                                   lambda file_name: NumpyChromeJsonExporter(file_name, serializer=False))
+
+    def test_encodes_arguments_of_a_chunk_like_json_dumps(self):
+        values = [{"args": [1, "a, NaN, b", [1.5, None]]}, {"kwargs": {"k": "\x1e\x1f"}}, {"args": [{"a": [1, 2]}]}]
+        assert export._encode_json_batch(values) == [json.dumps(value) for value in values]
+
+    def test_encodes_values_that_are_no_json(self):
+        values = [{"args": [float("nan")]}, {"args": [1]}, {"args": [object()]}]
+        assert export._encode_json_batch(values) == ['"<dict>"', '{"args": [1]}', '"<dict>"']
+
+    def test_keeps_worker_state_out_of_parent_process(self, monkeypatch):
+        monkeypatch.setattr(export, "_available_cpus", lambda: 2)
+        first_records = [TraceRecord("first", tuple(), dict(), datetime(2020, 1, 1, second=i)) for i in range(6)]
+        second_records = [TraceRecord("second", tuple(), dict(), datetime(2020, 1, 1, second=i)) for i in range(6)]
+        first_exporter = NumpyChromeJsonExporter("unused.json", chunk_size=3, processes=2)
+        first_chunks = first_exporter._format_events(first_records, datetime(2020, 1, 1))
+
+        # the second export runs while the pool of the first one is alive
+        first_chunk = next(first_chunks)
+        with tempfile.NamedTemporaryFile(suffix=".json") as f:
+            NumpyChromeJsonExporter(f.name, chunk_size=3, processes=2).export(second_records)
+            second_events = json.load(f)
+        first_events = json.loads("[" + ",".join([first_chunk, *first_chunks]) + "]")
+
+        assert export._WORKER_STATE is None
+        assert [event["name"] for event in first_events] == ["first"] * 6
+        assert [event["name"] for event in second_events] == ["second"] * 6
@@ -0,0 +1,123 @@
+from dataclasses import dataclass, field
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, List
+
+from .serialize import ArgumentSerializer, CYCLE, TRUNCATED
+
+
+@dataclass
+class Point:
+    x: int
+    y: Any
+
+
+@dataclass
+class Config:
+    name: str
+    cache: dict = field(init=False)
+
+
+class Unknown:
+    def __repr__(self):
+        return "Unknown()"
+
+
+class TestArgumentSerializer:
+    def test_keeps_json_values(self):
+        s = ArgumentSerializer()
+        value = {"a": [1, 2.5, None, True, "text"]}
+        assert s.serialize(value) == value
+
+    def test_serializes_datetimes_with_microseconds(self):
+        s = ArgumentSerializer()
+        assert s.serialize(datetime(2020, 1, 2, 3, 4, 5, 6)) == "2020-01-02T03:04:05.000006"
+
+    def test_serializes_other_builtin_types(self):
+        s = ArgumentSerializer()
+        assert s.serialize((1, 2)) == [1, 2]
+        assert s.serialize(Decimal("1.5")) == 1.5
+        assert s.serialize(float("nan")) == "nan"
+        assert s.serialize({1: "one"}) == [[1, "one"]]
+        assert s.serialize(Unknown()) == "Unknown()"
+
+    def test_serializes_dataclasses_without_copying(self):
+        s = ArgumentSerializer()
+        assert s.serialize(Point(1, Point(2, Unknown()))) == {"x": 1, "y": {"x": 2, "y": "Unknown()"}}
+
+    def test_falls_back_if_serializing_fails(self):
+        s = ArgumentSerializer()
+        # the unset field makes both the dataclass serializer and the generated __repr__ raise
+        assert s.serialize([Config("a"), 1]) == ["<Config>", 1]
+
+    def test_falls_back_to_repr_if_registered_serializer_raises(self):
+        def fail(obj, serialize):
+            raise RuntimeError()
+
+        s = ArgumentSerializer()
+        s.register(Unknown, fail)
+        assert s.serialize({"a": Unknown()}) == {"a": "Unknown()"}
+
+    def test_uses_registered_serializer_for_subclasses(self):
+        class SubUnknown(Unknown):
+            pass
+
+        s = ArgumentSerializer()
+        s.register(Unknown, lambda obj, serialize: "registered")
+        assert s.serialize(SubUnknown()) == "registered"
+
+    def test_registering_invalidates_dispatch_cache(self):
+        s = ArgumentSerializer()
+        assert s.serialize(Unknown()) == "Unknown()"
+        s.register(Unknown, lambda obj, serialize: "registered")
+        assert s.serialize(Unknown()) == "registered"
+
+    def test_limits_length(self):
+        s = ArgumentSerializer(max_length=2, max_string_length=3)
+        assert s.serialize([1, 2, 3]) == [1, 2, TRUNCATED]
+        assert s.serialize({"a": 1, "b": 2, "c": 3}) == {"a": 1, "b": 2, TRUNCATED: TRUNCATED}
+        assert s.serialize("abcd") == "abc" + TRUNCATED
+
+    def test_limits_length_of_keys(self):
+        s = ArgumentSerializer(max_string_length=3)
+        assert s.serialize({"abcd": 1}) == {"abc" + TRUNCATED: 1}
+
+    def test_keeps_keys_that_would_collide_as_pairs(self):
+        s = ArgumentSerializer(max_string_length=3)
+        assert s.serialize({1: "a", "1": "b"}) == [[1, "a"], ["1", "b"]]
+        assert s.serialize({"abcd": 1, "abce": 2}) == [["abc" + TRUNCATED, 1], ["abc" + TRUNCATED, 2]]
+
+    def test_keeps_int_subclasses(self):
+        class Big(int):
+            pass
+
+        s = ArgumentSerializer()
+        assert s.serialize(Big(3)) == 3
+        assert isinstance(s.serialize(Big(3)), int)
+
+    def test_limits_depth(self):
+        s = ArgumentSerializer(max_depth=1)
+        assert s.serialize([[[1]], "a"]) == [["<list>"], "a"]
+
+    def test_keeps_leaves_at_depth_limit(self):
+        s = ArgumentSerializer(max_depth=1, max_string_length=3)
+        date = datetime(2020, 1, 1)
+        assert s.serialize([[1.5, 2, None, "abcd", date]]) == [[1.5, 2, None, "abc" + TRUNCATED, date.isoformat()]]
+        assert ArgumentSerializer().serialize_arguments(([[[[1.5, 7]]]],), {}) == {"args": [[[[[1.5, 7]]]]]}
+
+    def test_replaces_cycles(self):
+        s = ArgumentSerializer()
+        value: List[Any] = [1]
+        value.append(value)
+        assert s.serialize(value) == [1, CYCLE]
+
+    def test_keeps_shared_values_that_are_no_cycles(self):
+        s = ArgumentSerializer()
+        shared = [1]
+        assert s.serialize([shared, shared]) == [[1], [1]]
+
+    def test_serialize_arguments_leaves_out_empty_ones(self):
+        s = ArgumentSerializer()
+        assert s.serialize_arguments(tuple(), dict()) == {}
+        assert s.serialize_arguments(("a",), dict()) == {"args": ["a"]}
+        assert s.serialize_arguments(tuple(), {"b": 1}) == {"kwargs": {"b": 1}}
@@ -1,6 +1,14 @@
-from datetime import datetime
+import functools
+import json
+import tempfile
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
 from typing import List
 
+import pytest
+
+from Debugger.capture import LatencyThresholdCapture, PercentileCapture
+from Debugger.export import ChromeJsonExporter, NumpyChromeJsonExporter
 from Debugger.trace import trace, TraceExporter, TraceRecord
 from Debugger.types import TimeProvider
 
@@ -177,3 +185,314 @@ def test_records_start_and_end_times():
     assert r.start_time == datetime(2020, 1, 2)
     assert r.end_time is not None
     assert r.end_time == datetime(2020, 1, 3)
+
+
+def test_records_call_that_raised():
+    p = MockExporter()
+
+    @trace(exporter=p)
+    def method():
+        raise ValueError()
+
+    with pytest.raises(ValueError):
+        method()
+
+    assert len(p.records) == 1
+    r = p.records[0]
+    assert r.function_name == "method"
+    assert r.end_time is not None
+
+
+def test_keeps_exception_of_call_if_export_fails():
+    class FailingExporter(TraceExporter):
+        def export(self, records: List[TraceRecord]):
+            raise OSError("disk")
+
+    @trace(exporter=FailingExporter())
+    def method():
+        raise ValueError("orig")
+
+    with pytest.raises(ValueError, match="orig"):
+        method()
+
+
+def test_raises_error_of_export_if_call_succeeded():
+    class FailingExporter(TraceExporter):
+        def export(self, records: List[TraceRecord]):
+            raise OSError("disk")
+
+    @trace(exporter=FailingExporter())
+    def method():
+        pass
+
+    with pytest.raises(OSError, match="disk"):
+        method()
+
+
+def test_raises_error_of_time_provider():
+    class FailingTimeProvider(TimeProvider):
+        def get_current_time(self) -> datetime:
+            raise RuntimeError("clock")
+
+    p = MockExporter()
+
+    @trace(exporter=p, time_provider=FailingTimeProvider())
+    def method():
+        pass
+
+    with pytest.raises(RuntimeError, match="clock"):
+        method()
+    assert len(p.records) == 0
+
+
+def test_exports_only_captured_calls():
+    p = MockExporter()
+    time_stamps = [
+        datetime(2020, 1, 1),
+        datetime(2020, 1, 2),
+        datetime(2020, 1, 3),
+        datetime(2020, 1, 4),
+        # the second call is fast
+        datetime(2020, 1, 5),
+        datetime(2020, 1, 5),
+        datetime(2020, 1, 5),
+        datetime(2020, 1, 5),
+    ]
+    t = MockTimeProvider(time_stamps)
+
+    @trace(exporter=p, time_provider=t, capture_policy=LatencyThresholdCapture(timedelta(days=1)))
+    def method():
+        my_arg_method("Test", kwarg="Hello")
+
+    method()
+    method()
+
+    assert len(p.records) == 2
+    assert p.records[0].function_name == "method"
+    assert p.records[0].start_time == datetime(2020, 1, 1)
+    assert p.records[1].function_name == "my_arg_method"
+
+
+def test_does_not_export_calls_that_are_not_captured():
+    p = MockExporter()
+
+    @trace(exporter=p, capture_policy=LatencyThresholdCapture(timedelta(days=1)))
+    def method():
+        my_method()
+
+    method()
+
+    assert len(p.records) == 0
+
+
+def test_exports_nested_records_of_slow_outliers():
+    p = MockExporter()
+    time_stamps = []
+    # the fourth call is the outlier, all others take one second
+    for day, duration in enumerate([1, 1, 1, 60, 1], start=1):
+        start = datetime(2020, 1, day)
+        time_stamps += [start, start, start, start + timedelta(seconds=duration)]
+    t = MockTimeProvider(time_stamps)
+    policy = PercentileCapture(percentile=50, window=10, min_samples=3)
+
+    @trace(exporter=p, time_provider=t, capture_policy=policy)
+    def method():
+        my_arg_method("Test", kwarg="Hello")
+
+    for _ in range(5):
+        method()
+
+    assert [r.function_name for r in p.records] == ["method", "my_arg_method"]
+    assert p.records[0].start_time == datetime(2020, 1, 4)
+    assert p.records[0].end_time == datetime(2020, 1, 4, minute=1)
+    assert p.records[1].arguments == ("Test",)
+    assert p.records[1].keyword_arguments == {"kwarg": "Hello"}
+
+
+class MyClass:
+    def __init__(self):
+        self._value = 0
+
+    def my_method(self, arg):
+        return arg
+
+    @staticmethod
+    def my_static_method(arg):
+        return arg
+
+    @classmethod
+    def my_class_method(cls, arg):
+        return cls, arg
+
+    @property
+    def my_property(self):
+        return self._value
+
+    @my_property.setter
+    def my_property(self, value):
+        self._value = value
+
+
+class my_property_type(property):
+    pass
+
+
+class my_static_method_type(staticmethod):
+    pass
+
+
+class MyDescriptorClass:
+    parse_binary = staticmethod(functools.partial(int, base=2))
+    class_property = classmethod(property(lambda cls: cls.__name__))  # type: ignore
+
+    @my_static_method_type
+    def my_static_method(arg):
+        return arg
+
+    @my_property_type
+    def my_property(self):
+        return 1
+
+
+class MyTracedClass:
+    @staticmethod
+    @trace()
+    def my_traced_static_method(arg):
+        return arg
+
+    @property
+    @trace()
+    def my_traced_property(self):
+        return 1
+
+
+def test_keeps_descriptors_that_wrap_no_functions():
+    p = MockExporter()
+
+    @trace(exporter=p)
+    def method():
+        assert MyDescriptorClass.parse_binary("11") == 3
+        return MyDescriptorClass().my_static_method("Test")
+
+    assert method() == "Test"
+    assert [r.function_name for r in p.records] == ["method", "MyDescriptorClass.my_static_method"]
+
+
+def test_keeps_descriptors_that_wrap_traced_functions():
+    p = MockExporter()
+    original_attributes = dict(vars(MyTracedClass))
+
+    @trace(exporter=p)
+    def method():
+        assert dict(vars(MyTracedClass)) == original_attributes
+        assert MyTracedClass.my_traced_static_method("Test") == "Test"
+        return MyTracedClass().my_traced_property
+
+    assert method() == 1
+    assert [r.function_name for r in p.records] == ["method"]
+
+
+def test_keeps_descriptor_subclasses_while_tracing():
+    types = []
+
+    @trace()
+    def method():
+        types.append(type(vars(MyDescriptorClass)["my_property"]))
+        types.append(type(vars(MyDescriptorClass)["my_static_method"]))
+        return MyDescriptorClass().my_property
+
+    assert method() == 1
+    assert types == [my_property_type, my_static_method_type]
+
+
+def test_unpatches_if_patching_fails():
+    original_attributes = dict(vars(MyClass))
+
+    class failing_trace(trace):
+        def _patch_descriptor(self, obj):
+            if obj is original_attributes["my_property"]:
+                raise RuntimeError("patching")
+            return super()._patch_descriptor(obj)
+
+    @failing_trace()
+    def method():
+        pass
+
+    with pytest.raises(RuntimeError, match="patching"):
+        method()
+    assert dict(vars(MyClass)) == original_attributes
+
+
+def test_records_method_calls_on_the_class():
+    p = MockExporter()
+
+    @trace(exporter=p)
+    def method():
+        obj = MyClass()
+        assert obj.my_method("Test") == "Test"
+        assert obj.my_static_method("Test") == "Test"
+        assert MyClass.my_class_method("Test") == (MyClass, "Test")
+
+    method()
+
+    assert [r.function_name for r in p.records] == [
+        "method", "MyClass.my_method", "MyClass.my_static_method", "MyClass.my_class_method"
+    ]
+    assert p.records[1].arguments[1:] == ("Test",)
+    assert p.records[2].arguments == ("Test",)
+    assert p.records[3].arguments == (MyClass, "Test")
+
+
+def test_records_property_access():
+    p = MockExporter()
+
+    @trace(exporter=p)
+    def method():
+        obj = MyClass()
+        obj.my_property = 1
+        assert obj.my_property == 1
+
+    method()
+
+    assert [r.function_name for r in p.records] == ["method", "MyClass.my_property", "MyClass.my_property"]
+    assert p.records[1].arguments[1:] == (1,)
+
+
+def test_restores_class_attributes_and_module_globals():
+    original_attributes = dict(vars(MyClass))
+    original_function = my_method
+
+    @trace()
+    def method():
+        MyClass().my_method("Test")
+
+    method()
+
+    assert dict(vars(MyClass)) == original_attributes
+    assert globals()["my_method"] is original_function
+    assert isinstance(vars(MyClass)["my_static_method"], staticmethod)
+
+
+@dataclass
+class Config:
+    name: str
+    cache: dict = field(init=False)
+
+
+def my_config_method(config):
+    pass
+
+
+def test_exports_arguments_that_can_not_be_serialized():
+    for exporter_class in (ChromeJsonExporter, NumpyChromeJsonExporter):
+        with tempfile.NamedTemporaryFile(suffix=".json") as f:
+            @trace(exporter=exporter_class(f.name))
+            def method():
+                my_config_method(Config("a"))
+                return "result"
+
+            assert method() == "result"
+            events = json.load(f)
+
+        assert [e["name"] for e in events] == ["method", "my_config_method"]
+        assert events[1]["args"] == {"args": ["<Config>"]}
@@ -2,13 +2,26 @@ import functools
 import inspect
 import logging
 import sys
-from typing import Union, Callable, List, Tuple, Any
+from datetime import timedelta
+from typing import Union, Callable, List, Tuple, Any, Dict, Set
 
+from .capture import CapturePolicy, CaptureAll
 from .export import TraceExporter
 from .types import TraceLevel, TraceRecord, TimeProvider, SystemTimeProvider
 
 LOGGER = logging.getLogger(__name__)
 
+# set on the functions returned by the decorator, so they are not patched themselves
+_TRACE_WRAPPER_ATTRIBUTE = "__trace_wrapper__"
+
+
+def _is_traceable_function(obj: Any) -> bool:
+    """
+    :param obj: a function, or anything stored in a descriptor
+    :return: whether obj is a function that was not built by trace itself
+    """
+    return inspect.isfunction(obj) and not getattr(obj, _TRACE_WRAPPER_ATTRIBUTE, False)
+
 
 class trace:
     """
@@ -16,12 +29,22 @@ class trace:
     """
 
     def __init__(self, level: TraceLevel = TraceLevel.ALL, packages: Union[str, list] = None,
-                 exporter: TraceExporter = None, time_provider: TimeProvider = None):
+                 exporter: TraceExporter = None, time_provider: TimeProvider = None,
+                 capture_policy: CapturePolicy = None):
         self.level = level
         self.module_names: List[str] = []
         self.exporter = exporter
         self.time_provider = time_provider if time_provider is not None else SystemTimeProvider()
+        # bound once, so a time provider defined in a traced module is never called through its own patch
+        self._get_current_time = self.time_provider.get_current_time
+        self.capture_policy = capture_policy if capture_policy is not None else CaptureAll()
+        # records of the captured calls, these get exported
         self.records: List[TraceRecord] = []
+        # records of the currently running top level call, reused for every call
+        self._buffer: List[TraceRecord] = []
+        self._is_running = False
+        # patched versions of the original functions / descriptors, built once and reused for every call
+        self._patched: Dict[Any, Any] = {}
 
         if isinstance(packages, str):
             self.module_names.append(packages)
@@ -45,15 +68,27 @@ class trace:
 
         @functools.wraps(func)
         def wrapper_func(*args, **kwargs):
-            objects_to_patch = self._get_objects_to_patch()
-            self._patch_objects(objects_to_patch)
-
-            result = self._call_function(func, args, kwargs)
-
-            self._unpatch_objects(objects_to_patch)
-            self._persist_trace_results()
-            return result
-
+            if self._is_running:
+                # the decorated function got called within its own trace
+                return self._call_function(func, args, kwargs)
+
+            objects_to_patch: List[Tuple[Any, str, Any]] = []
+            self._is_running = True
+            raised = False
+            try:
+                # inside the try, so whatever got patched before a failure is set back as well
+                objects_to_patch = self._get_objects_to_patch()
+                self._patch_objects(objects_to_patch)
+                return self._call_function(func, args, kwargs)
+            except BaseException:
+                raised = True
+                raise
+            finally:
+                self._is_running = False
+                self._unpatch_objects(objects_to_patch)
+                self._finish_call(raised)
+
+        setattr(wrapper_func, _TRACE_WRAPPER_ATTRIBUTE, True)
         return wrapper_func
 
     def _call_function(self, func: Any, args, kwargs):
@@ -64,93 +99,154 @@ class trace:
         :param kwargs:the kwargs of the function
         :return:
         """
-        start_time = self.time_provider.get_current_time()
+        start_time = self._get_current_time()
         record = TraceRecord(func.__name__, args, kwargs, start_time)
-        self.records.append(record)
-
-        result = func(*args, **kwargs)
+        self._buffer.append(record)
 
-        end_time = self.time_provider.get_current_time()
-        record.end_time = end_time
-
-        return result
+        try:
+            return func(*args, **kwargs)
+        finally:
+            end_time = self._get_current_time()
+            record.end_time = end_time
 
-    def _patch_objects(self, objects: List[Tuple[Any, Any]]) -> None:
+    def _patch_objects(self, objects: List[Tuple[Any, str, Any]]) -> None:
         """
         Patches any callable to inject tracer behaviour
-        :param objects: List of Tuples with <Module, class / function>
+        :param objects: List of Tuples with <Module / Class, attribute name, function / descriptor>
         :return: None
         """
-        for module, obj in objects:
-            self._patch_function(func=obj, module=module)
+        for owner, name, obj in objects:
+            if obj not in self._patched:
+                self._patched[obj] = self._patch_descriptor(obj)
+            setattr(owner, name, self._patched[obj])
+
+    def _patch_descriptor(self, obj: Any) -> Any:
+        """
+        Wraps a function, or the functions of a staticmethod, classmethod or property, keeping the descriptor type
+        (including subclasses). Property accessors that are no functions or wrappers of trace are kept as they are.
+        :param obj: the function or descriptor as stored in the module / class
+        :return: the patched function or descriptor
+        """
+        if isinstance(obj, (staticmethod, classmethod)):
+            return type(obj)(self._patch_function(obj.__func__))
+        if isinstance(obj, property):
+            accessors: List[Any] = [self._patch_function(func) if _is_traceable_function(func) else func
+                                    for func in (obj.fget, obj.fset, obj.fdel)]
+            fget, fset, fdel = accessors
+            # getter / setter / deleter copy the property with type(obj), so subclasses stay subclasses
+            return obj.getter(fget).setter(fset).deleter(fdel)
+        return self._patch_function(obj)
 
-    def _patch_function(self, func: Any, module: Any) -> None:
+    def _patch_function(self, func: Any) -> Callable:
         """
-        Monkey patches a function to inject tracer behaviour
+        Builds a wrapper specialized for one function to inject tracer behaviour.
+        Everything that does not change between calls is looked up once here instead of on every call.
         :param func: the function to patch
-        :param module: the module the function is implemented in
-        :return: None
+        :return: the patched function
         """
+        # the qualified name tells methods of different classes apart
+        function_name = getattr(func, "__qualname__", repr(func))
+        append_record = self._buffer.append
+        get_current_time = self._get_current_time
 
         @functools.wraps(func)
         def patched_function(*args, **kwargs):
-            return self._call_function(func, args, kwargs)
+            record = TraceRecord(function_name, args, kwargs, get_current_time())
+            append_record(record)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record.end_time = get_current_time()
 
-        setattr(module, func.__name__, patched_function)
+        return patched_function
 
-    def _unpatch_objects(self, objects: List[Tuple[Any, Any]]) -> None:
+    @staticmethod
+    def _unpatch_objects(objects: List[Tuple[Any, str, Any]]) -> None:
         """
         sets any object back to its original implementation
-        :param objects: a list of tuples containing <Module, class / function>
+        :param objects: a list of tuples containing <Module / Class, attribute name, function / descriptor>
         :return: None
         """
-        for module, obj in objects:
-            self._unpatch_function(obj, module)
+        for owner, name, obj in objects:
+            setattr(owner, name, obj)
 
-    @staticmethod
-    def _unpatch_function(func, module) -> None:
+    def _get_objects_to_patch(self) -> List[Tuple[Any, str, Any]]:
         """
-        sets a function back to its original behaviour
-        :param func: the function to unpatch
-        :param module: the corresponding module where the default implementation is
-        :return: None
+        Filters out every imported module that is listed in self.module_names and collects the functions
+        defined in them. Methods are collected from the class that defines them, so they get patched there.
+        :return: a List containing tuples with <Module / Class, attribute name, function / descriptor>
         """
-        setattr(module, func.__name__, func)
+        modules = [module for name, module in list(sys.modules.items()) if name in self.module_names]
+        result: List[Tuple[Any, str, Any]] = []
+        seen: Set[Tuple[int, str]] = set()
 
-    def _get_objects_to_patch(self) -> List[Tuple[Any, Any]]:
-        """
-        Filters out every imported module that is listed in self.module_names
-        :return: a List containing tuples with <Module, Class / Function>
-        """
-        modules = {mod: val for mod, val in sys.modules.items() if mod in self.module_names}
-        result: List[Tuple[Any, Any]] = []
-        for importing_module_name in modules:
-            mod_insp = {name: member for name, member in
-                        inspect.getmembers(modules[importing_module_name]) if
-                        not name.startswith("__")}
-            for member in mod_insp.values():
-                member_data = dict(inspect.getmembers(member))
+        def add(owner: Any, name: str, obj: Any) -> None:
+            # a class can be imported by more than one traced module, but may only be patched once
+            if (id(owner), name) not in seen:
+                seen.add((id(owner), name))
+                result.append((owner, name, obj))
 
-                if "__module__" not in member_data:
-                    # i m not quiet sure, but i think we did this to ignore built ins
+        for module in modules:
+            for name, member in list(vars(module).items()):
+                if name.startswith("__") or getattr(member, "__module__", None) not in self.module_names:
                     continue
 
-                module_name: str = member_data["__module__"]
-                if module_name in self.module_names:
-                    if inspect.isclass(member):
-                        filter_out_inbuilt_functions: Callable = lambda class_function_tuple: not class_function_tuple[0].startswith("__")
-                        for function_tuple in filter(filter_out_inbuilt_functions, inspect.getmembers(member)):
-                            result.append((modules[importing_module_name], function_tuple[1]))
-                    else:
-                        result.append((modules[importing_module_name], member))
+                if inspect.isclass(member):
+                    for attribute_name, attribute in list(vars(member).items()):
+                        if not attribute_name.startswith("__") and self._is_patchable(attribute):
+                            add(member, attribute_name, attribute)
+                elif self._is_patchable(member):
+                    add(module, name, member)
 
         return result
 
-    def _persist_trace_results(self):
+    @staticmethod
+    def _is_patchable(obj: Any) -> bool:
+        """
+        :param obj: a module or class attribute
+        :return: whether obj is a function or a descriptor wrapping functions, that was not built by trace itself
+        """
+        if isinstance(obj, (staticmethod, classmethod)):
+            # e.g. staticmethod(functools.partial(...)) or classmethod(property(...)) are left alone
+            return _is_traceable_function(obj.__func__)
+        if isinstance(obj, property):
+            return any(_is_traceable_function(func) for func in (obj.fget, obj.fset, obj.fdel))
+        return _is_traceable_function(obj)
+
+    def _finish_call(self, raised: bool) -> None:
         """
-        Calls the callback of persistor
+        Asks the capture policy whether the records of the finished top level call are kept.
+        Kept records get exported, the buffer is cleared either way so it can be reused by the next call.
+        Errors of the policy or the exporter are only logged if the call raised, so they don't replace its exception.
+        :param raised: whether the top level call raised an exception
+        :return: None
+        """
+        if not self._buffer:
+            # the time provider raised before the top level record was created
+            return
+
+        try:
+            top_level_record = self._buffer[0]
+            if top_level_record.end_time is None:
+                duration = timedelta(0)
+            else:
+                duration = top_level_record.end_time - top_level_record.start_time
+            if self.capture_policy.should_capture(duration, raised):
+                self.records.extend(self._buffer)
+                self._persist_trace_results(self.records[-len(self._buffer):])
+        except Exception:
+            if not raised:
+                raise
+            LOGGER.exception('capturing the trace of a call that raised failed')
+        finally:
+            self._buffer.clear()
+
+    def _persist_trace_results(self, records: List[TraceRecord]):
+        """
+        Hands the records of a captured call to the exporter, which only has to add them to what it exported before
+        :param records: the records of the captured call
         :return: None
         """
         if self.exporter is None:
             return
-        self.exporter.export(self.records)
+        self.exporter.append(records, self.records)